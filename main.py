@@ -7,14 +7,37 @@ Fecha: 27/01/2025
 """
 
 from typing import List, Dict
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Sequence
 from enum import Enum
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
+import bisect
+import gzip
 import json
+import mmap
+import os
+import struct
 import sys
 from prettytable import PrettyTable
 
 # ---------- Configuración persistencia --------------
 ARCHIVO_DATOS = "datos_veterinaria.json"
+ARCHIVO_SNAPSHOT = "datos_veterinaria.snap"
+ARCHIVO_RECORDATORIOS = "recordatorios_enviados.jsonl"
+DIRECTORIO_ARCHIVO = "archivo_citas"
+DIAS_RETENCION = 365  # Las citas más antiguas se mueven al archivo histórico
+
+def crear_backup(archivo: str):
+    """Copia el archivo de datos a <archivo>.backup si existe"""
+    try:
+        if os.path.exists(archivo):
+            import shutil
+            backup_file = f"{archivo}.backup"
+            shutil.copy2(archivo, backup_file)
+    except Exception as e:
+        print(f"No se pudo crear backup: {e}")
 
 # ---------- Clase para la veterinaria ---------------
 class Veterinaria:
@@ -26,11 +49,50 @@ class Veterinaria:
             cls._instance.clientes: List[Cliente] = []
             cls._instance.veterinarios: List[Veterinario] = []
             cls._instance.citas: List[Cita] = []
+            cls._instance.citas_invalidas: List[Dict] = []
+            cls._instance.citas_sin_asignar: List[Dict] = []
+            cls._instance.archivo = ArchivoCitas()
+            cls._instance.versiones: Dict[str, int] = dict.fromkeys(
+                ('clientes', 'mascotas', 'veterinarios', 'citas'), 0)
         return cls._instance
 
+    def marcar_cambio(self, *colecciones: str):
+        """Incrementa la versión de las colecciones modificadas (todas si no se indican)"""
+        for coleccion in colecciones or tuple(self.versiones):
+            self.versiones[coleccion] += 1
+
+    def archivar_citas(self, dias_retencion: int = DIAS_RETENCION) -> int:
+        """Mueve al archivo histórico las citas anteriores al periodo de retención"""
+        corte = datetime.now() - timedelta(days=dias_retencion)
+        antiguas = [c for c in self.citas if c.fecha < corte]
+        if not antiguas:
+            return 0
+
+        # Primero se escribe el archivo; solo después se quitan del conjunto activo
+        self.archivo.archivar(antiguas)
+        archivadas = {id(c) for c in antiguas}
+        self.citas[:] = [c for c in self.citas if id(c) not in archivadas]
+        for mascota in {id(c.mascota): c.mascota for c in antiguas}.values():
+            mascota.historial[:] = [c for c in mascota.historial if id(c) not in archivadas]
+        self.marcar_cambio('citas')
+        return len(antiguas)
+
+    def historial_completo(self, mascota) -> List:
+        """Historial de la mascota incluyendo las citas archivadas, cargadas bajo demanda"""
+        veterinarios_por_id = {v.id: v for v in self.veterinarios}
+        return self.archivo.historial_de(mascota, veterinarios_por_id) + list(mascota.historial)
+
     def guardar_datos(self):
         """Serializa todos los datos a formato JSON y los guarda en archivo"""
         try:
+            # Mantener pequeño el conjunto activo moviendo las citas antiguas al archivo
+            try:
+                archivadas = self.archivar_citas()
+                if archivadas:
+                    print(f"{archivadas} citas antiguas movidas al archivo histórico")
+            except Exception as e:
+                print(f"No se pudieron archivar las citas antiguas: {e}")
+
             datos = {
                 'veterinarios': [],
                 'clientes': [],
@@ -60,22 +122,26 @@ class Veterinaria:
                         datos['citas'].append(cita.to_dict())
                 except Exception as e:
                     print(f"Error al serializar cita: {e}")
+
+            # Conservar las citas que no se pudieron cargar hasta que se reparen
+            datos['citas'].extend(self.citas_invalidas)
+            if self.citas_sin_asignar:
+                datos['citas_sin_asignar'] = list(self.citas_sin_asignar)
             
             # Crear backup del archivo existente si existe
-            try:
-                import os
-                if os.path.exists(ARCHIVO_DATOS):
-                    import shutil
-                    backup_file = f"{ARCHIVO_DATOS}.backup"
-                    shutil.copy2(ARCHIVO_DATOS, backup_file)
-            except Exception as e:
-                print(f"No se pudo crear backup: {e}")
+            crear_backup(ARCHIVO_DATOS)
             
             # Guardar los datos en el archivo
             with open(ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
                 json.dump(datos, f, indent=2, ensure_ascii=False)
                 
             print("Datos guardados exitosamente")
+
+            # Actualizar el snapshot de solo lectura para los procesos de reportes
+            try:
+                escribir_snapshot(self)
+            except Exception as e:
+                print(f"No se pudo actualizar el snapshot: {e}")
             
         except Exception as e:
             print(f"Error al guardar los datos: {e}")
@@ -86,11 +152,24 @@ class Veterinaria:
         try:
             with open(ARCHIVO_DATOS, 'r', encoding='utf-8') as f:
                 datos = json.load(f)
+
+                # Migrar archivos antiguos que referencian por nombre
+                migrados = migrar_ids(datos)
+                if migrados:
+                    print(f"Se asignaron IDs a {migrados} registros del formato anterior")
+
+                # Validar y aplicar solo las reparaciones que no pierden datos
+                reporte = validar_integridad(datos, reparar=True)
+                if reporte.tiene_problemas():
+                    print(reporte)
                 
                 # Limpiar las listas actuales
                 self.veterinarios.clear()
                 self.clientes.clear()
                 self.citas.clear()
+                self.citas_invalidas.clear()
+                self.citas_sin_asignar[:] = datos.get('citas_sin_asignar', [])
+                self.marcar_cambio()
                 
                 # Primero cargar veterinarios
                 for vet_data in datos.get('veterinarios', []):
@@ -108,41 +187,19 @@ class Veterinaria:
                     except Exception as e:
                         print(f"Error al cargar cliente: {e}")
                 
+                # Índices por ID para resolver las referencias de las citas
+                veterinarios_por_id = {v.id: v for v in self.veterinarios}
+                mascotas_por_id = {m.id: m for c in self.clientes for m in c.mascotas}
+
                 # Finalmente cargar citas
                 for cita_data in datos.get('citas', []):
                     try:
-                        # Encontrar mascota y cliente
-                        mascota = None
-                        for cliente in self.clientes:
-                            for m in cliente.mascotas:
-                                if (m.nombre == cita_data['mascota_nombre'] and 
-                                    cliente.nombre == cita_data['cliente_nombre']):
-                                    mascota = m
-                                    break
-                            if mascota:
-                                break
-                                
-                        if not mascota:
-                            print(f"No se encontró la mascota {cita_data['mascota_nombre']}")
-                            continue
-                            
-                        # Encontrar veterinario
-                        veterinario = next(
-                            (v for v in self.veterinarios if v.nombre == cita_data['veterinario']),
-                            None
-                        )
-                        if not veterinario:
-                            print(f"No se encontró el veterinario {cita_data['veterinario']}")
-                            continue
-                            
-                        fecha = datetime.strptime(cita_data['fecha'], "%d/%m/%Y %H:%M")
-                        servicio = Servicio(cita_data['servicio'])
-                        
-                        cita = Cita(mascota, fecha, veterinario, servicio)
-                        mascota.agregar_cita(cita)
+                        cita = Cita.from_dict(cita_data, mascotas_por_id, veterinarios_por_id)
+                        cita.mascota.agregar_cita(cita)
                         self.citas.append(cita)
-                        
                     except Exception as e:
+                        # Se conserva tal cual para no perderla al guardar
+                        self.citas_invalidas.append(cita_data)
                         print(f"Error al cargar cita: {e}")
                         
         except FileNotFoundError:
@@ -152,13 +209,35 @@ class Veterinaria:
         except Exception as e:
             print(f"Error inesperado al cargar datos: {e}")
 
+# ---------- Generador de IDs estables --------------
+class GeneradorIds:
+    """Genera IDs enteros crecientes para un tipo de entidad"""
+    def __init__(self):
+        self._ultimo = 0
+
+    def siguiente(self) -> int:
+        self._ultimo += 1
+        return self._ultimo
+
+    def registrar(self, id_: int) -> int:
+        """Reserva un ID ya existente para que no se vuelva a generar"""
+        self._ultimo = max(self._ultimo, id_)
+        return id_
+
 # ---------- Clase para la persona   ----------------
 class Persona:
-    def __init__(self, nombre: str, contacto: str, direccion: str):
+    _ids = GeneradorIds()
+
+    def __init__(self, nombre: str, contacto: str, direccion: str, id_: int = None):
+        self._id = type(self)._ids.siguiente() if id_ is None else type(self)._ids.registrar(id_)
         self._nombre = nombre
         self._contacto = contacto
         self._direccion = direccion
 
+    @property
+    def id(self):
+        return self._id
+
     @property
     def nombre(self):
         return self._nombre
@@ -174,6 +253,7 @@ class Persona:
     def to_dict(self):
         """ Serializr la persona a diccionario """
         return {
+            'id': self._id,
             'nombre': self._nombre,
             'contacto': self._contacto,
             'direccion': self._direccion
@@ -184,9 +264,11 @@ class Persona:
 # --------- Clase para un cliente ------------------
 
 class Cliente(Persona):
-    def __init__(self, nombre, contacto, direccion):
+    _ids = GeneradorIds()
+
+    def __init__(self, nombre, contacto, direccion, id_: int = None):
         # Llamar correctamente al constructor de la clase padre
-        Persona.__init__(self, nombre, contacto, direccion)
+        Persona.__init__(self, nombre, contacto, direccion, id_)
         # Inicializar la lista de mascotas
         self.mascotas: List[Mascota] = []
 
@@ -205,7 +287,8 @@ class Cliente(Persona):
         cliente = cls(
             datos['nombre'],
             datos['contacto'],
-            datos['direccion']
+            datos['direccion'],
+            datos.get('id')
         )
         # Reconstruir mascotas
         for mascota_data in datos.get('mascotas', []):
@@ -217,18 +300,16 @@ class Cliente(Persona):
 
     def to_dict(self):
         """Serializa el cliente incluyendo sus mascotas"""
-        datos = {
-            'nombre': self.nombre,
-            'contacto': self.contacto,
-            'direccion': self.direccion,
-            'mascotas': [m.to_dict() for m in self.mascotas]
-        }
+        datos = super().to_dict()
+        datos['mascotas'] = [m.to_dict() for m in self.mascotas]
         return datos
 
 # --------- Clase para un Veterinario ------------------
 class Veterinario(Persona):
-    def __init__(self, nombre: str, contacto: str, direccion: str, especialidad: str):
-        super().__init__(nombre, contacto, direccion)
+    _ids = GeneradorIds()
+
+    def __init__(self, nombre: str, contacto: str, direccion: str, especialidad: str, id_: int = None):
+        super().__init__(nombre, contacto, direccion, id_)
         self.especialidad = especialidad
     
     def __str__(self):
@@ -240,7 +321,8 @@ class Veterinario(Persona):
             datos['nombre'],
             datos['contacto'],
             datos['direccion'],
-            datos['especialidad']
+            datos['especialidad'],
+            datos.get('id')
         )
 
     def to_dict(self):
@@ -261,6 +343,17 @@ class Servicio(Enum):
         # retorna la lista se servicios
         return [s.value for s in cls]
 
+def parsear_fecha(texto: str) -> datetime:
+    """
+    Convierte una fecha 'DD/MM/AAAA HH:MM' a datetime. El formato que escribe
+    to_dict se convierte directamente, sin el costo de strptime.
+    """
+    if (len(texto) == 16 and texto[2] == texto[5] == '/' and texto[10] == ' ' and texto[13] == ':'
+            and (texto[:2] + texto[3:5] + texto[6:10] + texto[11:13] + texto[14:]).isdigit()):
+        return datetime(int(texto[6:10]), int(texto[3:5]), int(texto[:2]),
+                        int(texto[11:13]), int(texto[14:]))
+    return datetime.strptime(texto, "%d/%m/%Y %H:%M")
+
 # Modificación en la clase Cita
 class Cita:
     def __init__(self, mascota, fecha: datetime, veterinario: Veterinario, servicio: Servicio):
@@ -280,47 +373,34 @@ class Cita:
 
     def to_dict(self):
         """Serializa la cita a diccionario"""
-        if self.mascota is None or self.mascota.nombre is None:
+        if self.mascota is None or self.mascota.id is None:
             raise ValueError("Datos de mascota inválidos en la cita")
-        if self.mascota.propietario is None or self.mascota.propietario.nombre is None:
-            raise ValueError("Datos de propietario inválidos en la cita")
-        if self.veterinario is None or self.veterinario.nombre is None:
+        if self.veterinario is None or self.veterinario.id is None:
             raise ValueError("Datos de veterinario inválidos en la cita")
             
         return {
-            'mascota_nombre': self.mascota.nombre,
-            'cliente_nombre': self.mascota.propietario.nombre,
+            'mascota_id': self.mascota.id,
             'fecha': self.fecha.strftime("%d/%m/%Y %H:%M"),
-            'veterinario': self.veterinario.nombre,
+            'veterinario_id': self.veterinario.id,
             'servicio': self.servicio.value
         }
 
     @classmethod
-    def from_dict(cls, datos: Dict, clientes: List[Cliente], veterinarios: List[Veterinario]):
-        """Reconstruye una cita desde diccionario"""
+    def from_dict(cls, datos: Dict, mascotas: Dict[int, 'Mascota'], veterinarios: Dict[int, Veterinario]):
+        """Reconstruye una cita desde diccionario usando índices por ID"""
         if not datos:
             raise ValueError("Datos de cita vacíos")
             
-        # Buscar mascota
-        mascota = None
-        for cliente in clientes:
-            for m in cliente.mascotas:
-                if m.nombre == datos.get('mascota_nombre') and cliente.nombre == datos.get('cliente_nombre'):
-                    mascota = m
-                    break
-            if mascota:
-                break
-                
+        mascota = mascotas.get(datos.get('mascota_id'))
         if mascota is None:
-            raise ValueError(f"No se encontró la mascota {datos.get('mascota_nombre')} del cliente {datos.get('cliente_nombre')}")
+            raise ValueError(f"No se encontró la mascota con ID {datos.get('mascota_id')}")
                 
-        # Buscar veterinario
-        veterinario = next((v for v in veterinarios if v.nombre == datos.get('veterinario')), None)
+        veterinario = veterinarios.get(datos.get('veterinario_id'))
         if veterinario is None:
-            raise ValueError(f"No se encontró el veterinario {datos.get('veterinario')}")
+            raise ValueError(f"No se encontró el veterinario con ID {datos.get('veterinario_id')}")
             
         try:
-            fecha = datetime.strptime(datos.get('fecha'), "%d/%m/%Y %H:%M")
+            fecha = parsear_fecha(datos.get('fecha'))
         except (ValueError, TypeError):
             raise ValueError("Formato de fecha inválido")
             
@@ -335,7 +415,10 @@ class Cita:
 
 # Modificar la clase Mascota para manejar mejor las referencias circulares
 class Mascota:
-    def __init__(self, nombre: str, especie: str, raza: str, edad: int, propietario: Cliente = None):
+    _ids = GeneradorIds()
+
+    def __init__(self, nombre: str, especie: str, raza: str, edad: int, propietario: Cliente = None, id_: int = None):
+        self._id = type(self)._ids.siguiente() if id_ is None else type(self)._ids.registrar(id_)
         self.nombre = nombre
         self.especie = especie
         self.raza = raza
@@ -343,6 +426,10 @@ class Mascota:
         self.propietario = propietario
         self.historial: List[Cita] = []
 
+    @property
+    def id(self):
+        return self._id
+
     def agregar_cita(self, cita: Cita):
         """Agrega una cita al historial de la mascota"""
         if cita not in self.historial:
@@ -358,7 +445,8 @@ class Mascota:
             datos['nombre'],
             datos['especie'],
             datos['raza'],
-            datos['edad']
+            datos['edad'],
+            id_=datos.get('id')
         )
         # El historial se cargará después para evitar referencias circulares
         return mascota
@@ -366,18 +454,868 @@ class Mascota:
     def to_dict(self):
         """Serializa la mascota incluyendo su historial"""
         return {
+            'id': self._id,
             'nombre': self.nombre,
             'especie': self.especie,
             'raza': self.raza,
             'edad': self.edad,
             'historial': [c.to_dict() for c in self.historial if c is not None]
         }
+
+# ------- Validación de integridad referencial -----
+
+class ReporteIntegridad:
+    """Resultado de una pasada de validación sobre los datos serializados"""
+    def __init__(self):
+        self.huerfanos: List[str] = []
+        self.duplicados: List[str] = []
+        self.inconsistentes: List[str] = []
+        self.reparaciones: List[str] = []
+
+    def tiene_problemas(self):
+        return bool(self.huerfanos or self.duplicados or self.inconsistentes)
+
+    def __str__(self):
+        if not self.tiene_problemas():
+            return "Integridad de datos: sin problemas"
+        lineas = [
+            f"Integridad de datos: {len(self.huerfanos)} huérfanos, "
+            f"{len(self.duplicados)} duplicados, {len(self.inconsistentes)} inconsistentes"
+        ]
+        for titulo, problemas in (("Huérfano", self.huerfanos),
+                                  ("Duplicado", self.duplicados),
+                                  ("Inconsistente", self.inconsistentes),
+                                  ("Reparación", self.reparaciones)):
+            lineas.extend(f"  - {titulo}: {p}" for p in problemas)
+        return "\n".join(lineas)
+
+
+def _clave_cita(datos: Dict):
+    """Clave hashable que identifica una cita serializada"""
+    return (
+        datos.get('mascota_id'),
+        datos.get('fecha'),
+        datos.get('veterinario_id'),
+        datos.get('servicio')
+    )
+
+
+def migrar_ids(datos: Dict) -> int:
+    """
+    Migra en sitio los datos del formato anterior, donde las citas referenciaban
+    por nombre, asignando IDs a las entidades y reemplazando los nombres por IDs.
+    Devuelve el número de registros modificados.
+    """
+    migrados = 0
+
+    def asignar(registros: List[Dict]):
+        nonlocal migrados
+        ultimo = max((r['id'] for r in registros if r.get('id') is not None), default=0)
+        for registro in registros:
+            if registro.get('id') is None:
+                ultimo += 1
+                registro['id'] = ultimo
+                migrados += 1
+
+    veterinarios = datos.get('veterinarios', [])
+    clientes = datos.get('clientes', [])
+    asignar(veterinarios)
+    asignar(clientes)
+    asignar([m for c in clientes for m in c.get('mascotas', [])])
+
+    # Índices por nombre solo para traducir las referencias antiguas
+    veterinarios_por_nombre = {}
+    for vet_data in veterinarios:
+        veterinarios_por_nombre.setdefault(vet_data.get('nombre'), vet_data['id'])
+    mascotas_por_nombre = {}
+    for cliente_data in clientes:
+        for mascota_data in cliente_data.get('mascotas', []):
+            clave = (cliente_data.get('nombre'), mascota_data.get('nombre'))
+            mascotas_por_nombre.setdefault(clave, mascota_data['id'])
+
+    def migrar_cita(cita_data: Dict):
+        nonlocal migrados
+        if 'mascota_id' in cita_data and 'veterinario_id' in cita_data:
+            return
+        clave = (cita_data.get('cliente_nombre'), cita_data.get('mascota_nombre'))
+        # Los nombres se conservan si no se pueden resolver, para el reporte
+        if clave in mascotas_por_nombre:
+            cita_data['mascota_id'] = mascotas_por_nombre[clave]
+            del cita_data['cliente_nombre'], cita_data['mascota_nombre']
+        else:
+            cita_data.setdefault('mascota_id', None)
+        if cita_data.get('veterinario') in veterinarios_por_nombre:
+            cita_data['veterinario_id'] = veterinarios_por_nombre[cita_data.pop('veterinario')]
+        else:
+            cita_data.setdefault('veterinario_id', None)
+        migrados += 1
+
+    for cita_data in datos.get('citas', []):
+        migrar_cita(cita_data)
+    for cliente_data in clientes:
+        for mascota_data in cliente_data.get('mascotas', []):
+            for cita_data in mascota_data.get('historial', []):
+                migrar_cita(cita_data)
+
+    return migrados
+
+
+def validar_integridad(datos: Dict, reparar: bool = False, descartar: bool = False) -> ReporteIntegridad:
+    """
+    Revisa en O(n) todas las referencias de los datos serializados usando índices hash.
+    Detecta registros huérfanos, duplicados e inconsistentes (por ejemplo historiales
+    que no coinciden con las citas). Con reparar=True corrige `datos` en sitio sin
+    perder nada: asigna IDs nuevos a los duplicados y reconstruye los historiales a
+    partir de las citas. Las citas cuyo ID de mascota está repetido siguen al
+    historial que las registra; si ninguno lo hace se apartan en
+    'citas_sin_asignar' en lugar de atribuirlas a una mascota. Solo con
+    descartar=True se eliminan las citas huérfanas, inválidas, repetidas o sin asignar.
+    """
+    reporte = ReporteIntegridad()
+    servicios_validos = set(Servicio.listar())
+    veterinarios_datos = datos.get('veterinarios', [])
+    clientes_datos = datos.get('clientes', [])
+    mascotas_datos = [m for c in clientes_datos for m in c.get('mascotas', [])]
+
+    # Los IDs nuevos se generan después de reservar todos los existentes
+    if reparar:
+        for clase, registros in ((Veterinario, veterinarios_datos), (Cliente, clientes_datos),
+                                 (Mascota, mascotas_datos)):
+            for registro in registros:
+                if isinstance(registro.get('id'), int):
+                    clase._ids.registrar(registro['id'])
+
+    # IDs de mascota repetidos y, al reparar, el ID nuevo de cada cita de sus historiales
+    ambiguos = set()
+    reubicadas: Dict[tuple, int] = {}
+
+    def indexar(clase, registros: List[Dict], tipo: str) -> Dict[int, Dict]:
+        """Índice por ID; los duplicados reciben un ID nuevo al reparar"""
+        indice: Dict[int, Dict] = {}
+        for registro in registros:
+            id_ = registro.get('id')
+            if id_ in indice:
+                reporte.duplicados.append(f"{tipo} #{id_} {registro.get('nombre')}")
+                if tipo == 'mascota':
+                    ambiguos.add(id_)
+                if not reparar:
+                    continue
+                registro['id'] = clase._ids.siguiente()
+                reporte.reparaciones.append(
+                    f"{tipo} {registro.get('nombre')} recibió el ID #{registro['id']} (antes #{id_})")
+                if tipo == 'mascota':
+                    # Sus citas del historial pasan a referenciar el ID nuevo
+                    for c in registro.get('historial', []):
+                        if c.get('mascota_id') == id_:
+                            reubicadas[_clave_cita(c)] = registro['id']
+                    registro['historial'] = [
+                        {**c, 'mascota_id': registro['id']} if c.get('mascota_id') == id_ else c
+                        for c in registro.get('historial', [])
+                    ]
+            indice[registro['id']] = registro
+        return indice
+
+    veterinarios = indexar(Veterinario, veterinarios_datos, 'veterinario')
+    indexar(Cliente, clientes_datos, 'cliente')
+    mascotas = indexar(Mascota, mascotas_datos, 'mascota')
+
+    def describir(clave):
+        return f"cita de la mascota #{clave[0]} {clave[1]}"
+
+    def verificar(cita_data: Dict, origen: str):
+        """Devuelve la clave de la cita si todas sus referencias son válidas"""
+        clave = _clave_cita(cita_data)
+        descripcion = f"{describir(clave)} ({origen})"
+        if clave[0] not in mascotas:
+            reporte.huerfanos.append(f"{descripcion}: mascota inexistente")
+            return None
+        if clave[2] not in veterinarios:
+            reporte.huerfanos.append(f"{descripcion}: veterinario inexistente")
+            return None
+        try:
+            parsear_fecha(clave[1])
+        except (ValueError, TypeError):
+            reporte.inconsistentes.append(f"{descripcion}: fecha inválida")
+            return None
+        if clave[3] not in servicios_validos:
+            reporte.inconsistentes.append(f"{descripcion}: servicio inválido")
+            return None
+        return clave
+
+    # Citas apartadas en reparaciones anteriores; siguen pendientes hasta descartarlas
+    sin_asignar: List[Dict] = list(datos.get('citas_sin_asignar', []))
+    for cita_data in sin_asignar:
+        reporte.inconsistentes.append(f"{describir(_clave_cita(cita_data))}: sin mascota asignada")
+    historiales_originales: Dict[int, set] = {}
+
+    def asignar(cita_data: Dict):
+        """Resuelve una cita cuyo ID de mascota está repetido según el historial que la registra"""
+        clave = _clave_cita(cita_data)
+        if clave in reubicadas:
+            return {**cita_data, 'mascota_id': reubicadas[clave]}
+        if clave[0] not in historiales_originales:
+            historiales_originales[clave[0]] = {
+                _clave_cita(c) for c in mascotas[clave[0]].get('historial', [])}
+        if clave in historiales_originales[clave[0]]:
+            return cita_data
+        reporte.inconsistentes.append(
+            f"{describir(clave)} (citas): el ID de mascota está repetido y ningún historial la registra")
+        sin_asignar.append(cita_data)
+        return None
+
+    # Citas de primer nivel: la fuente de verdad al cargar
+    citas: Dict[tuple, Dict] = {}
+    repetidas: List[Dict] = []
+    invalidas: Dict[tuple, Dict] = {}
+    for cita_data in datos.get('citas', []):
+        if cita_data.get('mascota_id') in ambiguos:
+            cita_data = asignar(cita_data)
+            if cita_data is None:
+                continue
+        clave = verificar(cita_data, "citas")
+        if clave is None:
+            invalidas.setdefault(_clave_cita(cita_data), cita_data)
+        elif clave in citas:
+            reporte.duplicados.append(describir(clave))
+            repetidas.append(cita_data)
+        else:
+            citas[clave] = cita_data
+
+    # Historiales: deben contener exactamente las citas de su mascota. Los
+    # problemas de cada cita se acumulan para reportarla una sola vez
+    motivos: Dict[tuple, List[str]] = {}
+    en_historial = set()
+    apartadas = {_clave_cita(c) for c in sin_asignar}
+    for id_mascota, mascota_data in mascotas.items():
+        for cita_data in mascota_data.get('historial', []):
+            # Las citas ya verificadas en el primer nivel no se vuelven a revisar
+            clave = _clave_cita(cita_data)
+            if clave in invalidas or clave in apartadas:
+                continue
+            if clave not in citas and clave[0] in ambiguos and clave[0] != id_mascota:
+                # Otro historial no basta para decidir cuál de las mascotas repetidas es
+                reporte.inconsistentes.append(
+                    f"{describir(clave)} (historial de la mascota #{id_mascota}): "
+                    "el ID de mascota está repetido")
+                apartadas.add(clave)
+                sin_asignar.append(cita_data)
+                continue
+            if clave not in citas:
+                if verificar(cita_data, f"historial de la mascota #{id_mascota}") is None:
+                    invalidas[clave] = cita_data
+                    continue
+                motivos.setdefault(clave, []).append("solo existe en un historial")
+                citas[clave] = cita_data
+            if clave[0] != id_mascota:
+                motivos.setdefault(clave, []).append(f"está en el historial de la mascota #{id_mascota}")
+            elif clave in en_historial:
+                reporte.duplicados.append(f"{describir(clave)} en el historial")
+            else:
+                en_historial.add(clave)
+
+    for clave in citas:
+        if clave not in en_historial:
+            motivos.setdefault(clave, []).append("falta en el historial de su mascota")
+    reporte.inconsistentes.extend(
+        f"{describir(clave)}: {', '.join(lista)}" for clave, lista in motivos.items())
+
+    if reparar:
+        conservadas = [] if descartar else repetidas
+        datos['citas'] = list(citas.values()) + ([] if descartar else repetidas + list(invalidas.values()))
+        datos.pop('citas_sin_asignar', None)
+        if sin_asignar and not descartar:
+            datos['citas_sin_asignar'] = sin_asignar
+        descartables = repetidas + list(invalidas.values()) + sin_asignar
+        for mascota_data in mascotas.values():
+            mascota_data['historial'] = []
+        for cita_data in list(citas.values()) + conservadas:
+            mascotas[cita_data['mascota_id']]['historial'].append(cita_data)
+        if motivos:
+            reporte.reparaciones.append(f"{len(motivos)} citas reubicadas en el historial de su mascota")
+        if descartables:
+            reporte.reparaciones.append(
+                f"{len(descartables)} citas huérfanas, inválidas, repetidas o sin asignar "
+                + ("descartadas" if descartar else
+                   "conservadas; use 'python main.py --validar --reparar' para descartarlas"))
+
+    return reporte
+
+
+def validar_archivo(archivo: str = ARCHIVO_DATOS, reparar: bool = False) -> ReporteIntegridad:
+    """Valida (y opcionalmente repara) un archivo de datos sin cargar la aplicación"""
+    with open(archivo, 'r', encoding='utf-8') as f:
+        datos = json.load(f)
+
+    migrados = migrar_ids(datos)
+    if migrados:
+        print(f"{migrados} registros sin IDs (formato anterior)")
+    reporte = validar_integridad(datos, reparar=reparar, descartar=reparar)
+    print(reporte)
+
+    if reparar and (migrados or reporte.tiene_problemas()):
+        crear_backup(archivo)
+        with open(archivo, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, indent=2, ensure_ascii=False)
+        print(f"Archivo {archivo} reparado")
+    return reporte
+
+# ------- Snapshot de solo lectura (mmap) ----------
+#
+# Formato binario (little endian), pensado para abrirse con mmap sin
+# reconstruir el grafo de objetos:
+#   cabecera (incluye mtime y tamaño del JSON de origen) | offsets de cadenas | veterinarios | clientes | mascotas |
+#   citas | índice de historiales | citas ordenadas por fecha | bloque de cadenas UTF-8
+# Los registros son de ancho fijo y las cadenas se guardan una sola vez en
+# la tabla de cadenas, referenciadas por su índice.
+
+_MAGIA_SNAPSHOT = b'VETSNAP3'
+# magia, n_cadenas, n_vets, n_clientes, n_mascotas, n_citas, n_historial, mtime_ns y tamaño del JSON
+_CABECERA = struct.Struct('<8s6I2q')
+_OFFSET = struct.Struct('<I')
+_REG_VETERINARIO = struct.Struct('<5I')  # id, nombre, contacto, direccion, especialidad
+_REG_CLIENTE = struct.Struct('<6I')      # id, nombre, contacto, direccion, primera mascota, n mascotas
+_REG_MASCOTA = struct.Struct('<5Ii2I')   # id, cliente, nombre, especie, raza, edad, inicio historial, n historial
+_REG_CITA = struct.Struct('<IIqI')       # mascota, veterinario, segundos desde la época, servicio
+_EPOCA = datetime(1970, 1, 1)
+_SERVICIOS = list(Servicio)
+
+
+def _segundos(fecha: datetime) -> int:
+    return int((fecha - _EPOCA).total_seconds())
+
+
+def _huella_datos() -> tuple:
+    """mtime (ns) y tamaño del archivo de datos; (0, 0) si todavía no existe"""
+    try:
+        estado = os.stat(ARCHIVO_DATOS)
+    except FileNotFoundError:
+        return (0, 0)
+    return (estado.st_mtime_ns, estado.st_size)
+
+
+def escribir_snapshot(veterinaria: Veterinaria, ruta: str = ARCHIVO_SNAPSHOT):
+    """
+    Escribe un snapshot binario de solo lectura de los datos en memoria. Se
+    guarda la huella del archivo de datos actual para detectar snapshots viejos.
+    """
+    cadenas: Dict[str, int] = {}
+
+    def cadena(texto) -> int:
+        texto = str(texto)
+        if texto not in cadenas:
+            cadenas[texto] = len(cadenas)
+        return cadenas[texto]
+
+    indice_vet = {id(v): i for i, v in enumerate(veterinaria.veterinarios)}
+    veterinarios = [
+        _REG_VETERINARIO.pack(v.id, cadena(v.nombre), cadena(v.contacto),
+                              cadena(v.direccion), cadena(v.especialidad))
+        for v in veterinaria.veterinarios
+    ]
+
+    citas_ordenadas = list(veterinaria.citas)
+    indice_cita = {id(c): i for i, c in enumerate(citas_ordenadas)}
+
+    clientes, mascotas, historial = [], [], []
+    indice_mascota: Dict[int, int] = {}
+    for i_cliente, cliente in enumerate(veterinaria.clientes):
+        clientes.append(_REG_CLIENTE.pack(
+            cliente.id, cadena(cliente.nombre), cadena(cliente.contacto),
+            cadena(cliente.direccion), len(mascotas), len(cliente.mascotas)))
+        for mascota in cliente.mascotas:
+            indice_mascota[id(mascota)] = len(mascotas)
+            inicio = len(historial)
+            for cita in mascota.historial:
+                if id(cita) not in indice_cita:
+                    indice_cita[id(cita)] = len(citas_ordenadas)
+                    citas_ordenadas.append(cita)
+                historial.append(indice_cita[id(cita)])
+            mascotas.append(_REG_MASCOTA.pack(
+                mascota.id, i_cliente, cadena(mascota.nombre), cadena(mascota.especie),
+                cadena(mascota.raza), mascota.edad, inicio, len(historial) - inicio))
+
+    citas = [
+        _REG_CITA.pack(indice_mascota[id(c.mascota)], indice_vet[id(c.veterinario)],
+                       _segundos(c.fecha), _SERVICIOS.index(c.servicio))
+        for c in citas_ordenadas
+    ]
+    por_fecha = sorted(range(len(citas_ordenadas)), key=lambda i: citas_ordenadas[i].fecha)
+
+    bloque = bytearray()
+    offsets = []
+    for texto in cadenas:
+        offsets.append(len(bloque))
+        bloque += texto.encode('utf-8')
+    offsets.append(len(bloque))
+
+    # Se escribe a un temporal y se reemplaza para no alterar los mmap abiertos
+    temporal = f"{ruta}.tmp"
+    with open(temporal, 'wb') as f:
+        f.write(_CABECERA.pack(_MAGIA_SNAPSHOT, len(cadenas), len(veterinarios),
+                               len(clientes), len(mascotas), len(citas), len(historial),
+                               *_huella_datos()))
+        f.write(struct.pack(f'<{len(offsets)}I', *offsets))
+        for registros in (veterinarios, clientes, mascotas, citas):
+            f.write(b''.join(registros))
+        f.write(struct.pack(f'<{len(historial)}I', *historial))
+        f.write(struct.pack(f'<{len(por_fecha)}I', *por_fecha))
+        f.write(bloque)
+    os.replace(temporal, ruta)
+
+
+class _VistaRegistros(Sequence):
+    """Secuencia perezosa que construye cada elemento al accederlo"""
+    def __init__(self, inicio: int, cantidad: int, construir):
+        self._inicio = inicio
+        self._cantidad = cantidad
+        self._construir = construir
+
+    def __len__(self):
+        return self._cantidad
+
+    def __getitem__(self, indice):
+        if isinstance(indice, slice):
+            return [self[i] for i in range(*indice.indices(self._cantidad))]
+        if indice < 0:
+            indice += self._cantidad
+        if not 0 <= indice < self._cantidad:
+            raise IndexError("Índice fuera de rango")
+        return self._construir(self._inicio + indice)
+
+
+class SnapshotVeterinaria:
+    """
+    Vista de solo lectura sobre un snapshot mapeado en memoria. Expone
+    `clientes`, `veterinarios` y `citas` con la misma forma que Veterinaria,
+    pero los objetos se construyen bajo demanda a partir de las páginas
+    compartidas, sin cargar todo el archivo.
+    """
+    MAX_ENTIDADES_EN_MEMORIA = 256
+
+    def __init__(self, ruta: str = ARCHIVO_SNAPSHOT, archivo: 'ArchivoCitas' = None):
+        self.archivo = archivo if archivo is not None else ArchivoCitas()
+        with open(ruta, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magia = self._mmap[:len(_MAGIA_SNAPSHOT)]
+        if magia != _MAGIA_SNAPSHOT:
+            self._mmap.close()
+            raise ValueError(f"{ruta} no es un snapshot de la veterinaria")
+        n_cadenas, n_vets, n_clientes, n_mascotas, n_citas, n_historial, *huella = \
+            _CABECERA.unpack_from(self._mmap, 0)[1:]
+        # Huella del archivo de datos del que se generó
+        self.origen = tuple(huella)
+
+        self._off_cadenas = _CABECERA.size
+        self._off_vets = self._off_cadenas + (n_cadenas + 1) * _OFFSET.size
+        self._off_clientes = self._off_vets + n_vets * _REG_VETERINARIO.size
+        self._off_mascotas = self._off_clientes + n_clientes * _REG_CLIENTE.size
+        self._off_citas = self._off_mascotas + n_mascotas * _REG_MASCOTA.size
+        self._off_historial = self._off_citas + n_citas * _REG_CITA.size
+        self._off_por_fecha = self._off_historial + n_historial * _OFFSET.size
+        self._off_bloque = self._off_por_fecha + n_citas * _OFFSET.size
+
+        # Solo se conservan las últimas entidades consultadas; las citas no se cachean
+        self._veterinarios: OrderedDict = OrderedDict()
+        self._clientes: OrderedDict = OrderedDict()
+        self._mascotas: OrderedDict = OrderedDict()
+
+        self.veterinarios = _VistaRegistros(0, n_vets, self._veterinario)
+        self.clientes = _VistaRegistros(0, n_clientes, self._cliente)
+        self.citas = _VistaRegistros(0, n_citas, self._cita)
+        # El snapshot es inmutable: las versiones nunca cambian
+        self.versiones: Dict[str, int] = dict.fromkeys(
+            ('clientes', 'mascotas', 'veterinarios', 'citas'), 0)
+
+    def cerrar(self):
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cerrar()
+
+    def _cadena(self, indice: int) -> str:
+        inicio, fin = struct.unpack_from('<2I', self._mmap, self._off_cadenas + indice * _OFFSET.size)
+        return self._mmap[self._off_bloque + inicio:self._off_bloque + fin].decode('utf-8')
+
+    def _recordar(self, cache: OrderedDict, indice: int, construir):
+        """Devuelve la entidad desde la caché LRU acotada o la construye"""
+        if indice in cache:
+            cache.move_to_end(indice)
+            return cache[indice]
+        entidad = construir(indice)
+        cache[indice] = entidad
+        if len(cache) > self.MAX_ENTIDADES_EN_MEMORIA:
+            cache.popitem(last=False)
+        return entidad
+
+    def _veterinario(self, indice: int) -> Veterinario:
+        return self._recordar(self._veterinarios, indice, self._construir_veterinario)
+
+    def _cliente(self, indice: int) -> Cliente:
+        return self._recordar(self._clientes, indice, self._construir_cliente)
+
+    def _mascota(self, indice: int) -> Mascota:
+        return self._recordar(self._mascotas, indice, self._construir_mascota)
+
+    def _construir_veterinario(self, indice: int) -> Veterinario:
+        id_, nombre, contacto, direccion, especialidad = _REG_VETERINARIO.unpack_from(
+            self._mmap, self._off_vets + indice * _REG_VETERINARIO.size)
+        return Veterinario(self._cadena(nombre), self._cadena(contacto), self._cadena(direccion),
+                           self._cadena(especialidad), id_)
+
+    def _construir_cliente(self, indice: int) -> Cliente:
+        id_, nombre, contacto, direccion, inicio, cantidad = _REG_CLIENTE.unpack_from(
+            self._mmap, self._off_clientes + indice * _REG_CLIENTE.size)
+        cliente = Cliente(self._cadena(nombre), self._cadena(contacto), self._cadena(direccion), id_)
+        cliente.mascotas = _VistaRegistros(inicio, cantidad, self._mascota)
+        return cliente
+
+    def _construir_mascota(self, indice: int) -> Mascota:
+        id_, cliente, nombre, especie, raza, edad, inicio, cantidad = _REG_MASCOTA.unpack_from(
+            self._mmap, self._off_mascotas + indice * _REG_MASCOTA.size)
+        mascota = Mascota(self._cadena(nombre), self._cadena(especie), self._cadena(raza),
+                          edad, self._cliente(cliente), id_)
+        mascota.historial = _VistaRegistros(inicio, cantidad, self._cita_historial)
+        return mascota
+
+    def _cita(self, indice: int) -> Cita:
+        mascota, veterinario, segundos, servicio = _REG_CITA.unpack_from(
+            self._mmap, self._off_citas + indice * _REG_CITA.size)
+        return Cita(self._mascota(mascota), _EPOCA + timedelta(seconds=segundos),
+                    self._veterinario(veterinario), _SERVICIOS[servicio])
+
+    def _cita_historial(self, posicion: int) -> Cita:
+        indice, = _OFFSET.unpack_from(self._mmap, self._off_historial + posicion * _OFFSET.size)
+        return self._cita(indice)
+
+    def _indice_por_fecha(self, posicion: int) -> int:
+        indice, = _OFFSET.unpack_from(self._mmap, self._off_por_fecha + posicion * _OFFSET.size)
+        return indice
+
+    def _segundos_por_fecha(self, posicion: int) -> int:
+        _, _, segundos, _ = _REG_CITA.unpack_from(
+            self._mmap, self._off_citas + self._indice_por_fecha(posicion) * _REG_CITA.size)
+        return segundos
+
+    def historial_completo(self, mascota) -> List[Cita]:
+        """Como Veterinaria.historial_completo: incluye las citas del archivo histórico"""
+        # Los veterinarios son pocos; se indexan todos para resolver las citas archivadas
+        veterinarios_por_id = {v.id: v for v in self.veterinarios}
+        return self.archivo.historial_de(mascota, veterinarios_por_id) + list(mascota.historial)
+
+    def citas_entre(self, desde: datetime, hasta: datetime) -> List[Cita]:
+        """Citas con fecha en [desde, hasta), ubicadas por bisección en el índice por fecha"""
+        fechas = _VistaRegistros(0, len(self.citas), self._segundos_por_fecha)
+        inicio = bisect.bisect_left(fechas, _segundos(desde))
+        fin = bisect.bisect_left(fechas, _segundos(hasta), lo=inicio)
+        return [self._cita(self._indice_por_fecha(p)) for p in range(inicio, fin)]
+
+def regenerar_snapshot(ruta: str = ARCHIVO_SNAPSHOT):
+    """Vuelve a escribir el snapshot a partir del archivo de datos"""
+    veterinaria = Veterinaria()
+    veterinaria.cargar_datos()
+    escribir_snapshot(veterinaria, ruta)
+
+
+def abrir_snapshot(ruta: str = ARCHIVO_SNAPSHOT) -> SnapshotVeterinaria:
+    """
+    Abre el snapshot; si no existe, es de un formato anterior o no corresponde
+    al archivo de datos actual lo regenera desde el JSON
+    """
+    try:
+        snapshot = SnapshotVeterinaria(ruta)
+    except (FileNotFoundError, ValueError, struct.error):
+        pass
+    else:
+        if snapshot.origen == _huella_datos():
+            return snapshot
+        snapshot.cerrar()
+        print(f"{ruta} no corresponde a {ARCHIVO_DATOS}; se regenera")
+    regenerar_snapshot(ruta)
+    return SnapshotVeterinaria(ruta)
+
+# ------- Archivo histórico de citas ---------------
+
+class ArchivoCitas:
+    """
+    Almacén de citas antiguas en particiones mensuales comprimidas con gzip.
+    Un índice por mascota indica qué particiones leer, y las particiones
+    leídas se conservan en una caché LRU pequeña.
+    """
+    MAX_PARTICIONES_EN_MEMORIA = 12
+
+    def __init__(self, directorio: str = DIRECTORIO_ARCHIVO):
+        self.directorio = directorio
+        self._indice: Dict[int, List[str]] = None
+        self._particiones: OrderedDict = OrderedDict()
+
+    def _ruta(self, particion: str) -> str:
+        return os.path.join(self.directorio, f"citas_{particion}.json.gz")
+
+    def _ruta_indice(self) -> str:
+        return os.path.join(self.directorio, "indice.json")
+
+    def _escribir(self, ruta: str, datos, comprimir: bool):
+        """Escribe a un temporal y lo reemplaza para no dejar archivos a medias"""
+        temporal = f"{ruta}.tmp"
+        abrir = gzip.open if comprimir else open
+        with abrir(temporal, 'wt', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False)
+        os.replace(temporal, ruta)
+
+    def indice(self) -> Dict[int, List[str]]:
+        if self._indice is None:
+            try:
+                with open(self._ruta_indice(), 'r', encoding='utf-8') as f:
+                    self._indice = {int(k): v for k, v in json.load(f).items()}
+            except FileNotFoundError:
+                self._indice = {}
+        return self._indice
+
+    def leer_particion(self, particion: str) -> List[Dict]:
+        if particion in self._particiones:
+            self._particiones.move_to_end(particion)
+            return self._particiones[particion]
+        try:
+            with gzip.open(self._ruta(particion), 'rt', encoding='utf-8') as f:
+                citas = json.load(f)
+        except FileNotFoundError:
+            citas = []
+        self._particiones[particion] = citas
+        if len(self._particiones) > self.MAX_PARTICIONES_EN_MEMORIA:
+            self._particiones.popitem(last=False)
+        return citas
+
+    def archivar(self, citas: List[Cita]):
+        """Agrega las citas a sus particiones mensuales, sin duplicar las ya archivadas"""
+        por_particion: Dict[str, List[Dict]] = {}
+        for cita in citas:
+            por_particion.setdefault(cita.fecha.strftime("%Y-%m"), []).append(cita.to_dict())
+
+        os.makedirs(self.directorio, exist_ok=True)
+        indice = self.indice()
+        for particion, nuevas in por_particion.items():
+            existentes = self.leer_particion(particion)
+            claves = {_clave_cita(c) for c in existentes}
+            combinadas = existentes + [c for c in nuevas if _clave_cita(c) not in claves]
+            self._escribir(self._ruta(particion), combinadas, comprimir=True)
+            self._particiones[particion] = combinadas
+            for cita_data in nuevas:
+                particiones = indice.setdefault(cita_data['mascota_id'], [])
+                if particion not in particiones:
+                    particiones.append(particion)
+                    particiones.sort()
+        self._escribir(self._ruta_indice(), indice, comprimir=False)
+
+    def historial_de(self, mascota, veterinarios_por_id: Dict[int, Veterinario]) -> List[Cita]:
+        """Reconstruye, ordenadas por fecha, las citas archivadas de una mascota"""
+        archivadas = []
+        for cita_data in self.citas_de(mascota.id):
+            try:
+                archivadas.append(Cita.from_dict(cita_data, {mascota.id: mascota}, veterinarios_por_id))
+            except ValueError as e:
+                print(f"Error al cargar cita archivada: {e}")
+        archivadas.sort(key=lambda c: c.fecha)
+        return archivadas
+
+    def citas_de(self, mascota_id: int) -> List[Dict]:
+        """Devuelve las citas archivadas de una mascota leyendo solo sus particiones"""
+        return [
+            cita_data
+            for particion in self.indice().get(mascota_id, [])
+            for cita_data in self.leer_particion(particion)
+            if cita_data.get('mascota_id') == mascota_id
+        ]
+
+# ------- Recordatorios de citas (asyncio) ---------
+
+class EnviadorRecordatorios(ABC):
+    """Interfaz para los canales de envío de recordatorios"""
+    @abstractmethod
+    async def enviar(self, contacto: str, mensaje: str):
+        """Envía un mensaje al contacto; debe lanzar una excepción si falla"""
+
+
+class EnviadorTexto(EnviadorRecordatorios):
+    """Escribe los recordatorios en un archivo de texto o en la salida estándar"""
+    def __init__(self, salida=None):
+        self.salida = salida if salida is not None else sys.stdout
+
+    async def enviar(self, contacto: str, mensaje: str):
+        self.salida.write(f"[{contacto}] {mensaje}\n")
+
+
+class LimitadorTasa:
+    """Espacia las llamadas para no superar `por_segundo` envíos por segundo"""
+    def __init__(self, por_segundo: float = None):
+        self._intervalo = 1 / por_segundo if por_segundo else 0
+        self._proximo = 0.0
+
+    async def esperar(self):
+        if not self._intervalo:
+            return
+        ahora = asyncio.get_running_loop().time()
+        turno = max(ahora, self._proximo)
+        self._proximo = turno + self._intervalo
+        if turno > ahora:
+            await asyncio.sleep(turno - ahora)
+
+
+class RegistroEnviados:
+    """
+    Registro persistente de los recordatorios ya enviados, por clave de cita,
+    para que repetir la ejecución el mismo día no los envíe de nuevo.
+    """
+    def __init__(self, ruta: str = ARCHIVO_RECORDATORIOS):
+        self.ruta = ruta
+        self._claves = set()
+        try:
+            with open(ruta, 'r', encoding='utf-8') as f:
+                self._claves = {tuple(json.loads(linea)) for linea in f if linea.strip()}
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, clave: tuple):
+        return clave in self._claves
+
+    def marcar(self, clave: tuple):
+        """Agrega la clave al registro y la escribe de inmediato"""
+        self._claves.add(clave)
+        with open(self.ruta, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(clave, ensure_ascii=False) + "\n")
+
+    def compactar(self, desde: datetime):
+        """Olvida las citas anteriores a `desde`, que ya no se volverán a consultar"""
+        vigentes = set()
+        for clave in self._claves:
+            try:
+                if parsear_fecha(clave[1]) >= desde:
+                    vigentes.add(clave)
+            except (ValueError, TypeError):
+                continue
+        if vigentes == self._claves:
+            return
+        self._claves = vigentes
+        temporal = f"{self.ruta}.tmp"
+        with open(temporal, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(c, ensure_ascii=False) + "\n" for c in vigentes)
+        os.replace(temporal, self.ruta)
+
+
+class ProgramadorRecordatorios:
+    """
+    Envía los recordatorios de las citas de una ventana de tiempo. Las citas se
+    piden a una fuente ordenada por fecha (por ejemplo SnapshotVeterinaria, que
+    las ubica por bisección), así que cada ejecución no recorre todas las citas.
+    """
+    def __init__(self, fuente, registro: RegistroEnviados = None):
+        self.fuente = fuente
+        self.registro = registro if registro is not None else RegistroEnviados()
+
+    async def enviar(self, enviador: EnviadorRecordatorios, desde: datetime = None,
+                     hasta: datetime = None, concurrencia: int = 10, por_segundo: float = 50,
+                     intentos: int = 3, espera_base: float = 0.5) -> Dict[str, int]:
+        """
+        Envía los recordatorios de las citas de la ventana (por defecto, mañana)
+        con concurrencia acotada, límite de tasa y reintentos con espera exponencial.
+        """
+        if desde is None:
+            desde = datetime.combine(datetime.now().date() + timedelta(days=1), datetime.min.time())
+        if hasta is None:
+            hasta = desde + timedelta(days=1)
+
+        resumen = {'enviados': 0, 'fallidos': 0, 'omitidos': 0}
+        cola = asyncio.Queue()
+        for cita in self.fuente.citas_entre(desde, hasta):
+            clave = _clave_cita(cita.to_dict())
+            if clave in self.registro:
+                resumen['omitidos'] += 1
+            else:
+                cola.put_nowait((clave, cita))
+        limitador = LimitadorTasa(por_segundo)
+
+        async def trabajador():
+            while True:
+                try:
+                    clave, cita = cola.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                if await self._enviar_cita(cita, enviador, limitador, intentos, espera_base):
+                    self.registro.marcar(clave)
+                    resumen['enviados'] += 1
+                else:
+                    resumen['fallidos'] += 1
+
+        await asyncio.gather(*(trabajador() for _ in range(max(1, concurrencia))))
+        self.registro.compactar(desde)
+        return resumen
+
+    @staticmethod
+    async def _enviar_cita(cita: Cita, enviador: EnviadorRecordatorios, limitador: LimitadorTasa,
+                           intentos: int, espera_base: float) -> bool:
+        propietario = cita.mascota.propietario
+        if propietario is None:
+            print(f"La mascota {cita.mascota.nombre} no tiene propietario, recordatorio omitido")
+            return False
+
+        mensaje = (
+            f"Recordatorio: {cita.mascota.nombre} tiene cita de {cita.servicio.value} "
+            f"con {cita.veterinario.nombre} el {cita.fecha.strftime('%d/%m/%Y %H:%M')}"
+        )
+        for intento in range(intentos):
+            await limitador.esperar()
+            try:
+                await enviador.enviar(propietario.contacto, mensaje)
+                return True
+            except Exception as e:
+                if intento + 1 == intentos:
+                    print(f"No se pudo enviar el recordatorio a {propietario.contacto}: {e}")
+                    return False
+                await asyncio.sleep(espera_base * 2 ** intento)
+        return False
+
+# ------- Caché de tablas renderizadas -------------
+
+class CacheTablas:
+    """
+    Caché LRU de tablas ya renderizadas. Cada tabla tiene una sola entrada,
+    guardada junto con las versiones de las colecciones que muestra; si las
+    versiones cambiaron, la tabla se reconstruye y reemplaza a la anterior.
+    El límite es el tamaño total del texto guardado, no el número de tablas.
+    """
+    def __init__(self, maximo_caracteres: int = 1_000_000):
+        self.maximo_caracteres = maximo_caracteres
+        self._tablas: OrderedDict = OrderedDict()
+        self._caracteres = 0
+
+    def obtener(self, clave: tuple, versiones: tuple, construir) -> str:
+        if clave in self._tablas:
+            versiones_guardadas, texto = self._tablas[clave]
+            if versiones_guardadas == versiones:
+                self._tablas.move_to_end(clave)
+                return texto
+            del self._tablas[clave]
+            self._caracteres -= len(texto)
+
+        texto = construir()
+        if len(texto) <= self.maximo_caracteres:
+            self._tablas[clave] = (versiones, texto)
+            self._caracteres += len(texto)
+            while self._caracteres > self.maximo_caracteres:
+                _, (_, antiguo) = self._tablas.popitem(last=False)
+                self._caracteres -= len(antiguo)
+        return texto
+
 # ------- Menu y validación de datos ---------------
 
 class Menu:
     def __init__(self):
         self.veterinaria = Veterinaria()
         self.veterinaria.cargar_datos()
+        self.cache_tablas = CacheTablas()
         self.opciones_validas = ["1", "2", "3", "4", "5", "6", "7"]
 
     def mostrar_menu(self):
@@ -464,6 +1402,7 @@ class Menu:
 
         nuevo_cliente = Cliente(nombre, contacto, direccion)
         self.veterinaria.clientes.append(nuevo_cliente)
+        self.veterinaria.marcar_cambio('clientes')
         print(f'Cliente {nuevo_cliente.nombre} registrado exitosamente!')
 
     def registrar_veterinario(self):
@@ -537,6 +1476,7 @@ class Menu:
 
         nuevo_veterinario = Veterinario(nombre, contacto, direccion, especialidad)
         self.veterinaria.veterinarios.append(nuevo_veterinario)
+        self.veterinaria.marcar_cambio('veterinarios')
         print(f'Veterinario {nuevo_veterinario.nombre} {nuevo_veterinario.especialidad} registrado exitosamente!')
 
     def registrar_mascota(self):
@@ -610,6 +1550,7 @@ class Menu:
 
         nueva_mascota = Mascota(nombre, especie, raza, edad, cliente_mascota)
         cliente_mascota.agregar_mascota(nueva_mascota)
+        self.veterinaria.marcar_cambio('mascotas')
         print(f'Mascota {nombre} registrada exitosamente! ')
 
     def programar_cita(self):
@@ -637,11 +1578,13 @@ class Menu:
                 return
 
             print("\nServicios disponibles: ")
-            tabla = PrettyTable()
-            tabla.field_names = ["ID", "Nombre"]
-            for id_, servicio in enumerate(Servicio.listar(), start=1):
-                tabla.add_row([f'{id_}', f'{servicio}'])
-            print(tabla)
+            def construir():
+                tabla = PrettyTable()
+                tabla.field_names = ["ID", "Nombre"]
+                for id_, servicio in enumerate(Servicio.listar(), start=1):
+                    tabla.add_row([f'{id_}', f'{servicio}'])
+                return tabla.get_string()
+            print(self.cache_tablas.obtener(('servicios',), (), construir))
 
             try:
                 seleccion = int(input("Seleccione servicio: ")) - 1
@@ -655,6 +1598,7 @@ class Menu:
             nueva_cita = Cita(mascota, fecha, veterinario, servicio)
             mascota.agregar_cita(nueva_cita)
             self.veterinaria.citas.append(nueva_cita)
+            self.veterinaria.marcar_cambio('citas')
             print(f'Cita programada para {mascota.nombre} el {fecha_str}')
             
         except Exception as e:
@@ -672,13 +1616,14 @@ class Menu:
             return
         
         print(f'\n Historial de {mascota.nombre} ({mascota.especie})')
-        if not mascota.historial:
+        historial = self.veterinaria.historial_completo(mascota)
+        if not historial:
             print("No hay citas registradas")
             return
 
         tabla = PrettyTable()
         tabla.field_names = ["Fecha", "Servicio", 'Veterinario', 'Especialidad']
-        for id_, cita in enumerate(mascota.historial, start=1):
+        for id_, cita in enumerate(historial, start=1):
             tabla.add_row([
                 f'{id_} - {cita.fecha.strftime('%d/%m/%Y %H:%M')}',
                 f'{cita.servicio.value}',
@@ -694,19 +1639,23 @@ class Menu:
         if not self.veterinaria.clientes:
             print('No hay clientes que mostrar')
             return
-        tabla = PrettyTable()
-        # Definir columnas
+        def construir():
+            tabla = PrettyTable()
+            # Definir columnas
+            tabla.field_names = ["ID", "Nombre", "Contacto", f"Mascotas"]
+            for id_, cliente in enumerate(self.veterinaria.clientes, start=1):
+                tabla.add_row([
+                        f'{id_}', 
+                        f'{cliente.nombre}',
+                        f'{cliente.contacto}',
+                        f'{"\n".join(map(lambda mascota: mascota.nombre, cliente.mascotas))}'
+                    ])
+                tabla.add_row([f' ',f' ',f' ',f' '])
+            return tabla.get_string()
         print("\nClientes disponibles:")
-        tabla.field_names = ["ID", "Nombre", "Contacto", f"Mascotas"]
-        for id_, cliente in enumerate(self.veterinaria.clientes, start=1):
-            tabla.add_row([
-                    f'{id_}', 
-                    f'{cliente.nombre}',
-                    f'{cliente.contacto}',
-                    f'{"\n".join(map(lambda mascota: mascota.nombre, cliente.mascotas))}'
-                ])
-            tabla.add_row([f' ',f' ',f' ',f' '])
-        print(tabla)
+        versiones = self.veterinaria.versiones
+        print(self.cache_tablas.obtener(
+            ('listar_clientes',), (versiones['clientes'], versiones['mascotas']), construir))
 
 
     # Métodos auxiliares 
@@ -715,14 +1664,17 @@ class Menu:
         if not self.veterinaria.clientes:
             print('No tienes clientes')
             return None
-        tabla = PrettyTable()
-        # Definir columnas
+        def construir():
+            tabla = PrettyTable()
+            # Definir columnas
+            tabla.field_names = ["ID", "Nombre"]
+            for id_, cliente in enumerate(self.veterinaria.clientes, start=1):
+                tabla.add_row([f'{id_}', f'{cliente.nombre}'])
+                tabla.add_row([f' ',f' '])
+            return tabla.get_string()
         print("\nClientes disponibles:")
-        tabla.field_names = ["ID", "Nombre"]
-        for id_, cliente in enumerate(self.veterinaria.clientes, start=1):
-            tabla.add_row([f'{id_}', f'{cliente.nombre}'])
-            tabla.add_row([f' ',f' '])
-        print(tabla)
+        print(self.cache_tablas.obtener(
+            ('seleccionar_cliente',), (self.veterinaria.versiones['clientes'],), construir))
 
         try:
             seleccion = int(input("Seleccione un cliente: ")) - 1
@@ -738,14 +1690,17 @@ class Menu:
         if not cliente.mascotas:
             print("Este cliente no tiene mascotas")
             return None
-        tabla = PrettyTable()
-        # Definir columnas
+        def construir():
+            tabla = PrettyTable()
+            # Definir columnas
+            tabla.field_names = ["ID", "Nombre", f'Especie']
+            for id_, mascota in enumerate(cliente.mascotas, start=1):
+                tabla.add_row([f'{id_}', f'{mascota.nombre}', f'{mascota.especie}'])
+                tabla.add_row([f' ',f' ',f' '])
+            return tabla.get_string()
         print(f"\nMascotas de {cliente.nombre}: ")
-        tabla.field_names = ["ID", "Nombre", f'Especie']
-        for id_, mascota in enumerate(cliente.mascotas, start=1):
-            tabla.add_row([f'{id_}', f'{mascota.nombre}', f'{mascota.especie}'])
-            tabla.add_row([f' ',f' ',f' '])
-        print(tabla)
+        print(self.cache_tablas.obtener(
+            ('seleccionar_mascota', cliente.id), (self.veterinaria.versiones['mascotas'],), construir))
 
         try:
             seleccion = int(input("Seleccione una mascota: ")) - 1
@@ -761,14 +1716,17 @@ class Menu:
         if not self.veterinaria.veterinarios:
             print('No tienes veterinarios')
             return None
-        tabla = PrettyTable()
-        # Definir columnas
+        def construir():
+            tabla = PrettyTable()
+            # Definir columnas
+            tabla.field_names = ["ID", "Nombre", "Especialidad"]
+            for id_, veterinario in enumerate(self.veterinaria.veterinarios, start=1):
+                tabla.add_row([f'{id_}', f'{veterinario.nombre}', f'{veterinario.especialidad}'])
+                tabla.add_row([f' ',f' ', f' '])
+            return tabla.get_string()
         print("\nVeterinarios disponibles:")
-        tabla.field_names = ["ID", "Nombre", "Especialidad"]
-        for id_, veterinario in enumerate(self.veterinaria.veterinarios, start=1):
-            tabla.add_row([f'{id_}', f'{veterinario.nombre}', f'{veterinario.especialidad}'])
-            tabla.add_row([f' ',f' ', f' '])
-        print(tabla)
+        print(self.cache_tablas.obtener(
+            ('seleccionar_veterinario',), (self.veterinaria.versiones['veterinarios'],), construir))
 
         try:
             seleccion = int(input("Seleccione un veterinario: ")) - 1
@@ -804,6 +1762,26 @@ class Menu:
 
 # ------- función principal y utilización -----------
 def main():
+    argumentos = sys.argv[1:]
+    if '--validar' in argumentos:
+        reparar = '--reparar' in argumentos
+        validar_archivo(reparar=reparar)
+        if reparar:
+            # El snapshot debe reflejar el archivo reparado
+            regenerar_snapshot()
+            print(f"Snapshot actualizado en {ARCHIVO_SNAPSHOT}")
+        return
+    if '--snapshot' in argumentos:
+        regenerar_snapshot()
+        print(f"Snapshot escrito en {ARCHIVO_SNAPSHOT}")
+        return
+    if '--recordatorios' in argumentos:
+        # Se lee el snapshot en lugar de cargar todo el JSON
+        with abrir_snapshot() as snapshot:
+            resumen = asyncio.run(ProgramadorRecordatorios(snapshot).enviar(EnviadorTexto()))
+        print(f"Recordatorios enviados: {resumen['enviados']}, fallidos: {resumen['fallidos']}, "
+              f"ya enviados antes: {resumen['omitidos']}")
+        return
     menu = Menu()
     menu.ejecutar()
 
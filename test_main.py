@@ -0,0 +1,577 @@
+"""
+Pruebas de persistencia: viajes de ida y vuelta to_dict/from_dict y
+guardar_datos/cargar_datos sobre clínicas generadas al azar de varios tamaños,
+con presupuestos de tiempo y memoria para la carga y el guardado.
+
+Ejecutar con: python -m pytest -q
+"""
+
+import asyncio
+import copy
+import json
+import os
+import random
+import string
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+import pytest
+
+import main
+
+# Caracteres que suelen romper la serialización: acentos, comillas, saltos de línea, emojis
+ALFABETO = string.ascii_letters + string.digits + " áéíóúñÑü'\"\\\n\t/🐾🐶"
+
+# Presupuestos para la prueba de escala, medidos con 100 000 citas: guardar 3,6 s
+# y 100 MB, cargar 3,3 s y 220 MB. Los tiempos dependen de la máquina, así que
+# solo detectan regresiones graves; la memoria es determinista y se ajusta más.
+# La prueba tarda cerca de un minuto y se activa con VETERINARIA_ESCALA=1
+CITAS_ESCALA = 100_000
+SEGUNDOS_GUARDAR = 30
+SEGUNDOS_CARGAR = 30
+MEMORIA_PICO_GUARDAR_MB = 130
+MEMORIA_PICO_CARGA_MB = 260
+
+
+def texto_aleatorio(rng: random.Random, minimo: int = 3, maximo: int = 20) -> str:
+    return ''.join(rng.choice(ALFABETO) for _ in range(rng.randint(minimo, maximo)))
+
+
+def generar_clinica(veterinaria, n_citas: int, semilla: int, desde: datetime = None):
+    """Llena la veterinaria con datos aleatorios reproducibles y sin citas repetidas"""
+    rng = random.Random(semilla)
+    desde = desde or datetime.now().replace(second=0, microsecond=0)
+    n_clientes = max(1, n_citas // 10)
+
+    veterinarios = [
+        main.Veterinario(texto_aleatorio(rng), texto_aleatorio(rng, 5), texto_aleatorio(rng, 5),
+                         texto_aleatorio(rng, 5))
+        for _ in range(rng.randint(1, 20))
+    ]
+    veterinaria.veterinarios.extend(veterinarios)
+
+    mascotas = []
+    for _ in range(n_clientes):
+        # Los nombres se repiten a propósito: las referencias van por ID
+        cliente = main.Cliente(rng.choice(["Ana", "Luis", texto_aleatorio(rng)]),
+                               texto_aleatorio(rng, 5), texto_aleatorio(rng, 5))
+        veterinaria.clientes.append(cliente)
+        for _ in range(rng.randint(0, 4)):
+            mascota = main.Mascota(rng.choice(["Firulais", texto_aleatorio(rng)]),
+                                   texto_aleatorio(rng), texto_aleatorio(rng), rng.randint(0, 30))
+            cliente.agregar_mascota(mascota)
+            mascotas.append(mascota)
+
+    if not mascotas:
+        cliente = veterinaria.clientes[0]
+        cliente.agregar_mascota(main.Mascota("Firulais", "Perro", "Mestizo", 1))
+        mascotas.append(cliente.mascotas[0])
+
+    # Minutos distintos para que ninguna cita sea un duplicado exacto de otra
+    servicios = list(main.Servicio)
+    for minuto in rng.sample(range(n_citas * 3), n_citas):
+        mascota = rng.choice(mascotas)
+        cita = main.Cita(mascota, desde + timedelta(minutes=minuto),
+                         rng.choice(veterinarios), rng.choice(servicios))
+        mascota.historial.append(cita)
+        veterinaria.citas.append(cita)
+
+
+def estado(veterinaria) -> dict:
+    """Representación serializada completa para comparar dos clínicas"""
+    return {
+        'veterinarios': [v.to_dict() for v in veterinaria.veterinarios],
+        'clientes': [c.to_dict() for c in veterinaria.clientes],
+        'citas': [c.to_dict() for c in veterinaria.citas],
+    }
+
+
+@pytest.fixture
+def veterinaria(tmp_path, monkeypatch):
+    """Veterinaria vacía trabajando en un directorio temporal"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(main.Veterinaria, '_instance', None)
+    return main.Veterinaria()
+
+
+@pytest.mark.parametrize("semilla", range(20))
+def test_to_dict_from_dict_ida_y_vuelta(veterinaria, semilla):
+    generar_clinica(veterinaria, 50, semilla)
+
+    veterinarios = {}
+    for veterinario in veterinaria.veterinarios:
+        copia = main.Veterinario.from_dict(veterinario.to_dict())
+        assert copia.to_dict() == veterinario.to_dict()
+        veterinarios[copia.id] = copia
+
+    mascotas = {}
+    for cliente in veterinaria.clientes:
+        copia = main.Cliente.from_dict(json.loads(json.dumps(cliente.to_dict())), [])
+        assert [m.propietario for m in copia.mascotas] == [copia] * len(copia.mascotas)
+        assert (copia.id, copia.nombre, copia.contacto, copia.direccion) == \
+            (cliente.id, cliente.nombre, cliente.contacto, cliente.direccion)
+        for original, mascota in zip(cliente.mascotas, copia.mascotas):
+            assert main.Mascota.from_dict(original.to_dict(), []).to_dict() == \
+                {**original.to_dict(), 'historial': []}
+            mascotas[mascota.id] = mascota
+
+    for cita in veterinaria.citas:
+        copia = main.Cita.from_dict(cita.to_dict(), mascotas, veterinarios)
+        assert copia.to_dict() == cita.to_dict()
+        assert copia.mascota is mascotas[cita.mascota.id]
+
+
+@pytest.mark.parametrize("n_citas,semilla", [(0, 0), (1, 1), (10, 2), (1_000, 3), (10_000, 4)])
+def test_guardar_cargar_ida_y_vuelta(veterinaria, n_citas, semilla):
+    generar_clinica(veterinaria, n_citas, semilla)
+    esperado = estado(veterinaria)
+
+    veterinaria.guardar_datos()
+    veterinaria.cargar_datos()
+
+    assert estado(veterinaria) == esperado
+    for cliente in veterinaria.clientes:
+        for mascota in cliente.mascotas:
+            assert mascota.propietario is cliente
+            assert all(cita.mascota is mascota for cita in mascota.historial)
+
+    # Un segundo ciclo no debe alterar nada
+    veterinaria.guardar_datos()
+    veterinaria.cargar_datos()
+    assert estado(veterinaria) == esperado
+
+
+def test_ida_y_vuelta_con_citas_archivadas(veterinaria):
+    antiguas = datetime.now().replace(second=0, microsecond=0) - timedelta(days=3 * 365)
+    generar_clinica(veterinaria, 2_000, 5, desde=antiguas)
+    historiales = {
+        m.id: [c.to_dict() for c in m.historial]
+        for cliente in veterinaria.clientes for m in cliente.mascotas
+    }
+
+    veterinaria.guardar_datos()
+    veterinaria.cargar_datos()
+
+    assert len(veterinaria.citas) < 2_000
+    for cliente in veterinaria.clientes:
+        for mascota in cliente.mascotas:
+            completo = [c.to_dict() for c in veterinaria.historial_completo(mascota)]
+            assert sorted(completo, key=main._clave_cita) == \
+                sorted(historiales[mascota.id], key=main._clave_cita)
+
+
+def test_snapshot_incluye_el_historial_archivado(veterinaria):
+    antiguas = datetime.now().replace(second=0, microsecond=0) - timedelta(days=3 * 365)
+    generar_clinica(veterinaria, 2_000, 7, desde=antiguas)
+    historiales = {
+        m.id: sorted(c.to_dict()['fecha'] for c in m.historial)
+        for cliente in veterinaria.clientes for m in cliente.mascotas
+    }
+
+    veterinaria.guardar_datos()
+
+    with main.SnapshotVeterinaria() as snapshot:
+        assert len(snapshot.citas) < 2_000
+        for cliente in snapshot.clientes:
+            for mascota in cliente.mascotas:
+                completo = [c.to_dict()['fecha'] for c in snapshot.historial_completo(mascota)]
+                assert sorted(completo) == historiales[mascota.id]
+
+
+def test_abrir_snapshot_regenera_si_el_json_cambio(veterinaria, monkeypatch):
+    generar_clinica(veterinaria, 10, 8)
+    veterinaria.guardar_datos()
+
+    # El JSON se reescribe sin tocar el snapshot, como al fallar su escritura
+    veterinaria.veterinarios.append(main.Veterinario('Nueva', '22000000', 'Puebla', 'Dentista'))
+    with monkeypatch.context() as parche:
+        parche.setattr(main, 'escribir_snapshot', lambda *args: 1 / 0)
+        veterinaria.guardar_datos()
+    with main.SnapshotVeterinaria() as viejo:
+        assert len(viejo.veterinarios) == 8
+
+    with main.abrir_snapshot() as snapshot:
+        assert snapshot.veterinarios[-1].nombre == 'Nueva'
+        assert snapshot.origen == main._huella_datos()
+
+
+def test_validar_y_reparar_actualiza_el_snapshot(veterinaria, monkeypatch):
+    datos = datos_validos()
+    datos['citas'].append({'mascota_id': 99, 'fecha': '01/01/2099 09:00',
+                           'veterinario_id': 1, 'servicio': 'Consulta'})
+    with open(main.ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    veterinaria.cargar_datos()
+    main.escribir_snapshot(veterinaria)
+
+    monkeypatch.setattr(main.sys, 'argv', ['main.py', '--validar', '--reparar'])
+    main.main()
+    with main.SnapshotVeterinaria() as snapshot:
+        assert snapshot.origen == main._huella_datos()
+        assert len(snapshot.citas) == 1
+
+
+def test_carga_archivo_con_referencias_por_nombre(veterinaria):
+    datos = {
+        'veterinarios': [{'nombre': 'Fernando Lopez', 'contacto': '22456780',
+                          'direccion': 'Atlixco Puebla', 'especialidad': 'Cirujano'}],
+        'clientes': [{'nombre': 'Jorge Luis', 'contacto': '3432245111', 'direccion': 'Mexico',
+                      'mascotas': [{'nombre': 'Tormenta', 'especie': 'Caballo',
+                                    'raza': 'Pura sangre', 'edad': 3, 'historial': []}]}],
+        'citas': [{'mascota_nombre': 'Tormenta', 'cliente_nombre': 'Jorge Luis',
+                   'fecha': '12/12/2099 13:15', 'veterinario': 'Fernando Lopez',
+                   'servicio': 'Vacunación'}],
+    }
+    with open(main.ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+
+    veterinaria.cargar_datos()
+
+    mascota = veterinaria.clientes[0].mascotas[0]
+    assert [c.mascota for c in veterinaria.citas] == [mascota]
+    assert mascota.historial == veterinaria.citas
+    assert veterinaria.citas[0].veterinario is veterinaria.veterinarios[0]
+
+
+def datos_validos() -> dict:
+    """Archivo mínimo y consistente: dos clientes con una mascota cada uno"""
+    cita = {'mascota_id': 1, 'fecha': '12/12/2099 13:15', 'veterinario_id': 1,
+            'servicio': 'Vacunación'}
+    return {
+        'veterinarios': [{'id': 1, 'nombre': 'Fernando Lopez', 'contacto': '22456780',
+                          'direccion': 'Atlixco Puebla', 'especialidad': 'Cirujano'}],
+        'clientes': [
+            {'id': 1, 'nombre': 'Jorge Luis', 'contacto': '3432245111', 'direccion': 'Mexico',
+             'mascotas': [{'id': 1, 'nombre': 'Tormenta', 'especie': 'Caballo',
+                           'raza': 'Pura sangre', 'edad': 3, 'historial': [dict(cita)]}]},
+            {'id': 2, 'nombre': 'Ana Perez', 'contacto': '2442325371', 'direccion': 'Puebla',
+             'mascotas': [{'id': 2, 'nombre': 'Fiera', 'especie': 'Gato',
+                           'raza': 'Pardo', 'edad': 2, 'historial': []}]},
+        ],
+        'citas': [dict(cita)],
+    }
+
+
+def historial(datos: dict, id_mascota: int) -> list:
+    return next(m['historial'] for c in datos['clientes'] for m in c['mascotas']
+                if m['id'] == id_mascota)
+
+
+def test_validar_datos_consistentes():
+    datos = datos_validos()
+    assert not main.validar_integridad(datos, reparar=True).tiene_problemas()
+    assert datos == datos_validos()
+
+
+def test_validar_cita_huerfana(veterinaria):
+    datos = datos_validos()
+    huerfana = {'mascota_id': 99, 'fecha': '13/12/2099 10:00',
+                'veterinario_id': 1, 'servicio': 'Consulta'}
+    datos['citas'].append(huerfana)
+    reporte = main.validar_integridad(copy.deepcopy(datos))
+    assert len(reporte.huerfanos) == 1 and not reporte.inconsistentes
+
+    # Cargar y guardar no la elimina del archivo
+    with open(main.ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    veterinaria.cargar_datos()
+    veterinaria.guardar_datos()
+    with open(main.ARCHIVO_DATOS, 'r', encoding='utf-8') as f:
+        assert huerfana in json.load(f)['citas']
+
+    # La reparación de arranque la conserva; solo descartar la elimina
+    conservados = copy.deepcopy(datos)
+    main.validar_integridad(conservados, reparar=True)
+    assert len(conservados['citas']) == 2
+    main.validar_integridad(datos, reparar=True, descartar=True)
+    assert len(datos['citas']) == 1
+
+
+def test_validar_mascota_con_id_repetido(veterinaria):
+    datos = datos_validos()
+    otra = {'id': 1, 'nombre': 'OTRA', 'especie': 'Perro', 'raza': 'Mestizo', 'edad': 1,
+            'historial': [{'mascota_id': 1, 'fecha': '01/01/2099 09:00', 'veterinario_id': 1,
+                           'servicio': 'Consulta'}]}
+    datos['clientes'][1]['mascotas'].append(otra)
+    reporte = main.validar_integridad(copy.deepcopy(datos))
+    assert len(reporte.duplicados) == 1
+
+    with open(main.ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    veterinaria.cargar_datos()
+    veterinaria.guardar_datos()
+    veterinaria.cargar_datos()
+
+    # Ninguna mascota ni cita se pierde: OTRA recibe un ID nuevo y conserva su cita
+    mascotas = {m.nombre: m for c in veterinaria.clientes for m in c.mascotas}
+    assert set(mascotas) == {'Tormenta', 'Fiera', 'OTRA'}
+    assert mascotas['OTRA'].id not in (1, 2)
+    assert mascotas['OTRA'].propietario.nombre == 'Ana Perez'
+    assert [c.fecha for c in mascotas['OTRA'].historial] == [datetime(2099, 1, 1, 9, 0)]
+    assert len(mascotas['Tormenta'].historial) == 1
+    assert len(veterinaria.citas) == 2
+
+
+def test_mascota_con_id_repetido_conserva_sus_citas_de_primer_nivel(veterinaria):
+    datos = datos_validos()
+    cita_otra = {'mascota_id': 1, 'fecha': '01/01/2099 09:00', 'veterinario_id': 1,
+                 'servicio': 'Consulta'}
+    otra = {'id': 1, 'nombre': 'OTRA', 'especie': 'Perro', 'raza': 'Mestizo', 'edad': 1,
+            'historial': [dict(cita_otra)]}
+    datos['clientes'][1]['mascotas'].append(otra)
+    datos['citas'].append(dict(cita_otra))
+
+    reparados = copy.deepcopy(datos)
+    main.validar_integridad(reparados, reparar=True)
+    assert len(reparados['citas']) == 2
+    assert historial(reparados, 1) == datos['citas'][:1]
+    otra_id = reparados['clientes'][1]['mascotas'][1]['id']
+    assert otra_id != 1
+    assert [c['fecha'] for c in historial(reparados, otra_id)] == ['01/01/2099 09:00']
+    assert {c['mascota_id'] for c in reparados['citas']} == {1, otra_id}
+
+    with open(main.ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False)
+    veterinaria.cargar_datos()
+    veterinaria.guardar_datos()
+    veterinaria.cargar_datos()
+
+    mascotas = {m.nombre: m for c in veterinaria.clientes for m in c.mascotas}
+    assert [c.fecha for c in mascotas['Tormenta'].historial] == [datetime(2099, 12, 12, 13, 15)]
+    assert [c.fecha for c in mascotas['OTRA'].historial] == [datetime(2099, 1, 1, 9, 0)]
+    assert len(veterinaria.citas) == 2
+
+
+@pytest.mark.parametrize('descartar', [False, True])
+def test_cita_de_mascota_repetida_sin_historial_se_aparta(veterinaria, descartar):
+    datos = datos_validos()
+    otra = {'id': 1, 'nombre': 'OTRA', 'especie': 'Perro', 'raza': 'Mestizo', 'edad': 1,
+            'historial': []}
+    datos['clientes'][1]['mascotas'].append(otra)
+    sin_dueno = {'mascota_id': 1, 'fecha': '01/01/2099 09:00', 'veterinario_id': 1,
+                 'servicio': 'Consulta'}
+    datos['citas'].append(dict(sin_dueno))
+
+    reporte = main.validar_integridad(datos, reparar=True, descartar=descartar)
+    assert any('ningún historial la registra' in p for p in reporte.inconsistentes)
+    assert datos['citas'] == [historial(datos, 1)[0]]
+    assert all(not m['historial'] for m in datos['clientes'][1]['mascotas'])
+    assert datos.get('citas_sin_asignar', []) == ([] if descartar else [sin_dueno])
+
+    if not descartar:
+        # Se conserva entre cargas sin atribuirse a ninguna mascota
+        with open(main.ARCHIVO_DATOS, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, ensure_ascii=False)
+        veterinaria.cargar_datos()
+        veterinaria.guardar_datos()
+        veterinaria.cargar_datos()
+        assert len(veterinaria.citas) == 1
+        assert veterinaria.citas_sin_asignar == [sin_dueno]
+
+
+def test_validar_cita_repetida():
+    datos = datos_validos()
+    datos['citas'].append(dict(datos['citas'][0]))
+    reporte = main.validar_integridad(copy.deepcopy(datos))
+    assert len(reporte.duplicados) == 1
+
+    conservados = copy.deepcopy(datos)
+    main.validar_integridad(conservados, reparar=True)
+    assert len(conservados['citas']) == 2
+    main.validar_integridad(datos, reparar=True, descartar=True)
+    assert len(datos['citas']) == 1 and len(historial(datos, 1)) == 1
+
+
+def test_validar_historial_divergente():
+    datos = datos_validos()
+    # Una cita de Tormenta que solo aparece, mal ubicada, en el historial de Fiera
+    mal_ubicada = {'mascota_id': 1, 'fecha': '02/02/2099 08:30', 'veterinario_id': 1,
+                   'servicio': 'Cirugia'}
+    historial(datos, 2).append(mal_ubicada)
+    original = copy.deepcopy(datos)
+
+    reporte = main.validar_integridad(datos)
+    assert datos == original
+    assert len(reporte.inconsistentes) == 1 and not reporte.huerfanos
+
+    main.validar_integridad(datos, reparar=True)
+    assert mal_ubicada in datos['citas']
+    assert mal_ubicada in historial(datos, 1) and historial(datos, 2) == []
+    assert not main.validar_integridad(datos).tiene_problemas()
+
+
+class EnviadorPrueba(main.EnviadorRecordatorios):
+    """Canal de prueba: falla las primeras `fallos` veces por contacto y mide la concurrencia"""
+    def __init__(self, fallos: int = 0, demora: float = 0):
+        self.fallos = fallos
+        self.demora = demora
+        self.intentos = {}
+        self.enviados = []
+        self.instantes = []
+        self.activos = 0
+        self.max_activos = 0
+
+    async def enviar(self, contacto, mensaje):
+        self.intentos[contacto] = self.intentos.get(contacto, 0) + 1
+        self.instantes.append(asyncio.get_running_loop().time())
+        self.activos += 1
+        self.max_activos = max(self.max_activos, self.activos)
+        try:
+            await asyncio.sleep(self.demora)
+            if self.intentos[contacto] <= self.fallos:
+                raise ConnectionError("canal no disponible")
+            self.enviados.append((contacto, mensaje))
+        finally:
+            self.activos -= 1
+
+
+MANANA = datetime(2099, 6, 2)
+
+
+def snapshot_con_citas(veterinaria, n_manana: int, n_otros_dias: int):
+    """Escribe un snapshot con citas mañana (una por cliente) y en otros días"""
+    veterinario = main.Veterinario("Fernando Lopez", "22456780", "Atlixco", "Cirujano")
+    veterinaria.veterinarios.append(veterinario)
+    fechas = [MANANA + timedelta(minutes=i) for i in range(n_manana)]
+    fechas += [MANANA + timedelta(days=(-1) ** i * (2 + i)) for i in range(n_otros_dias)]
+    for i, fecha in enumerate(fechas):
+        cliente = main.Cliente(f"Cliente {i}", f"contacto-{i}", "Puebla")
+        mascota = main.Mascota(f"Mascota {i}", "Perro", "Mestizo", 1)
+        cliente.agregar_mascota(mascota)
+        cita = main.Cita(mascota, fecha, veterinario, main.Servicio.CONSULTA)
+        mascota.agregar_cita(cita)
+        veterinaria.clientes.append(cliente)
+        veterinaria.citas.append(cita)
+    main.escribir_snapshot(veterinaria)
+    return main.SnapshotVeterinaria()
+
+
+def enviar(snapshot, enviador, **opciones):
+    opciones = {'desde': MANANA, 'hasta': MANANA + timedelta(days=1),
+                'por_segundo': None, 'espera_base': 0, **opciones}
+    programador = main.ProgramadorRecordatorios(snapshot)
+    return asyncio.run(programador.enviar(enviador, **opciones))
+
+
+def test_recordatorios_solo_de_la_ventana_y_sin_repetir(veterinaria):
+    with snapshot_con_citas(veterinaria, 30, 200) as snapshot:
+        assert [c.fecha for c in snapshot.citas_entre(MANANA, MANANA + timedelta(days=1))] == \
+            [MANANA + timedelta(minutes=i) for i in range(30)]
+
+        enviador = EnviadorPrueba()
+        assert enviar(snapshot, enviador) == {'enviados': 30, 'fallidos': 0, 'omitidos': 0}
+        assert len(enviador.enviados) == 30
+
+        # Una segunda ejecución el mismo día no repite los envíos
+        otro = EnviadorPrueba()
+        assert enviar(snapshot, otro) == {'enviados': 0, 'fallidos': 0, 'omitidos': 30}
+        assert otro.enviados == []
+
+
+def test_recordatorios_reintentan_con_espera_exponencial(veterinaria):
+    with snapshot_con_citas(veterinaria, 1, 0) as snapshot:
+        # Sin intentos suficientes la cita queda como fallida y no se marca como enviada
+        enviador = EnviadorPrueba(fallos=5)
+        assert enviar(snapshot, enviador, intentos=2)['fallidos'] == 1
+        assert enviador.intentos == {'contacto-0': 2}
+
+        enviador = EnviadorPrueba(fallos=2)
+        assert enviar(snapshot, enviador, intentos=3, espera_base=0.05)['enviados'] == 1
+        assert enviador.intentos == {'contacto-0': 3}
+        primera, segunda, tercera = enviador.instantes
+        assert segunda - primera >= 0.05 * 0.9
+        assert tercera - segunda >= 0.10 * 0.9
+
+
+def test_recordatorios_con_concurrencia_acotada(veterinaria):
+    with snapshot_con_citas(veterinaria, 40, 0) as snapshot:
+        enviador = EnviadorPrueba(demora=0.01)
+        enviar(snapshot, enviador, concurrencia=4)
+        assert len(enviador.enviados) == 40
+        assert enviador.max_activos == 4
+
+
+def test_recordatorios_respetan_el_limite_de_tasa(veterinaria):
+    with snapshot_con_citas(veterinaria, 10, 0) as snapshot:
+        enviador = EnviadorPrueba()
+        enviar(snapshot, enviador, concurrencia=10, por_segundo=50)
+        assert len(enviador.enviados) == 10
+        # 10 envíos a 50 por segundo ocupan al menos 9 intervalos de 20 ms
+        assert enviador.instantes[-1] - enviador.instantes[0] >= 9 * 0.02 * 0.9
+
+
+def test_cache_tablas_reemplaza_por_version_y_acota_por_tamano():
+    cache = main.CacheTablas(maximo_caracteres=10)
+    construidas = []
+
+    def tabla(texto):
+        def construir():
+            construidas.append(texto)
+            return texto
+        return construir
+
+    assert cache.obtener(('clientes',), (1,), tabla('aaaa')) == 'aaaa'
+    assert cache.obtener(('clientes',), (1,), tabla('otra')) == 'aaaa'
+    # Una versión nueva reemplaza la entrada en lugar de añadir otra
+    assert cache.obtener(('clientes',), (2,), tabla('bbbb')) == 'bbbb'
+    assert construidas == ['aaaa', 'bbbb']
+    assert len(cache._tablas) == 1
+
+    cache.obtener(('mascotas', 1), (1,), tabla('cccc'))
+    cache.obtener(('mascotas', 2), (1,), tabla('dddd'))
+    assert list(cache._tablas) == [('mascotas', 1), ('mascotas', 2)]
+    assert cache._caracteres <= cache.maximo_caracteres
+
+    # Una tabla más grande que el límite se devuelve sin guardarse
+    assert cache.obtener(('servicios',), (), tabla('x' * 20)) == 'x' * 20
+    assert ('servicios',) not in cache._tablas
+
+
+def test_menu_lista_desde_un_snapshot(veterinaria, capsys):
+    generar_clinica(veterinaria, 20, 9)
+    veterinaria.guardar_datos()
+    nombres = [c.nombre for c in veterinaria.clientes]
+
+    menu = main.Menu()
+    with main.SnapshotVeterinaria() as snapshot:
+        menu.veterinaria = snapshot
+        capsys.readouterr()
+        menu.listar_clientes()
+        salida = capsys.readouterr().out
+    assert all(nombre.splitlines()[0] in salida for nombre in nombres)
+
+
+@pytest.mark.skipif(not os.environ.get('VETERINARIA_ESCALA'),
+                    reason="prueba lenta; activar con VETERINARIA_ESCALA=1")
+def test_escala_presupuestos_de_tiempo_y_memoria(veterinaria):
+    futuras = datetime.now().replace(second=0, microsecond=0) + timedelta(days=1)
+    generar_clinica(veterinaria, CITAS_ESCALA, 6, desde=futuras)
+    esperado = estado(veterinaria)
+
+    inicio = time.perf_counter()
+    veterinaria.guardar_datos()
+    assert time.perf_counter() - inicio < SEGUNDOS_GUARDAR
+
+    inicio = time.perf_counter()
+    veterinaria.cargar_datos()
+    assert time.perf_counter() - inicio < SEGUNDOS_CARGAR
+    assert estado(veterinaria) == esperado
+
+    # La memoria se mide en otra pasada porque tracemalloc distorsiona los tiempos
+    tracemalloc.start()
+    veterinaria.guardar_datos()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert pico / 2 ** 20 < MEMORIA_PICO_GUARDAR_MB
+
+    tracemalloc.start()
+    veterinaria.cargar_datos()
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert pico / 2 ** 20 < MEMORIA_PICO_CARGA_MB
+
+    # El snapshot escrito al guardar debe describir los mismos datos
+    with main.SnapshotVeterinaria() as snapshot:
+        assert len(snapshot.citas) == CITAS_ESCALA
+        assert [c.to_dict() for c in snapshot.citas] == esperado['citas']